@@ -1,17 +1,29 @@
-from pymongo import MongoClient
-from langchain_ollama import OllamaLLM
+import threading
 
-# MongoDB (SAME DB AS APP)
-client = MongoClient("mongodb://localhost:27017/")
-db = client["Mledger"]
-collection = db["statements"]
+import db
+import metrics
 
-# Initialize Ollama with timeout
-try:
-    llm = OllamaLLM(model="llama3", base_url="http://localhost:11434")
-except Exception as e:
-    print(f"Error initializing Ollama: {e}")
-    llm = None
+OLLAMA_MODEL = "llama3"
+OLLAMA_BASE_URL = "http://localhost:11434"
+
+_llm = None
+_llm_failed = False
+_llm_lock = threading.Lock()
+
+
+def get_llm():
+    """Create the shared Ollama client on first use. Returns None if unavailable."""
+    global _llm, _llm_failed
+    if _llm is None and not _llm_failed:
+        with _llm_lock:
+            if _llm is None and not _llm_failed:
+                try:
+                    from langchain_ollama import OllamaLLM
+                    _llm = OllamaLLM(model=OLLAMA_MODEL, base_url=OLLAMA_BASE_URL)
+                except Exception as e:
+                    print(f"Error initializing Ollama: {e}")
+                    _llm_failed = True
+    return _llm
 
 def build_statement_context(statement_doc):
     tx_lines = []
@@ -29,18 +41,10 @@ Balance: {totals.get('balance',0)}
 """
     return "\n".join(tx_lines) + "\n" + totals_text
 
-def ask_latest_statement(question: str):
-    if llm is None:
-        return "AI service is not available. Please ensure Ollama is running with llama3 model."
-    
-    stmt = collection.find_one({}, sort=[("uploaded_at", -1)])
-
-    if not stmt:
-        return "No statement found. Please upload a statement first."
-
-    context = build_statement_context(stmt)
+def build_prompt(statement_doc, question: str):
+    context = build_statement_context(statement_doc)
 
-    prompt = f"""
+    return f"""
 You are an assistant that answers questions ONLY from this M-Pesa statement.
 
 STATEMENT:
@@ -54,8 +58,23 @@ Rules:
 - Be concise
 """
 
+def ask_latest_statement(question: str):
+    llm = get_llm()
+    if llm is None:
+        return "AI service is not available. Please ensure Ollama is running with llama3 model."
+    
+    with metrics.timed("query"):
+        # MongoDB (SAME DB AS APP)
+        stmt = db.statements_collection().find_one({}, sort=[("uploaded_at", -1)])
+
+    if not stmt:
+        return "No statement found. Please upload a statement first."
+
+    prompt = build_prompt(stmt, question)
+
     try:
-        response = llm.invoke(prompt)
+        with metrics.timed("llm_call"):
+            response = llm.invoke(prompt)
         return str(response)
     except Exception as e:
         return f"Error getting AI response: {str(e)}"
\ No newline at end of file
@@ -1,28 +1,23 @@
 import os, json, hashlib
 from pathlib import Path
-from flask import Flask, render_template, request, jsonify, send_file, redirect, url_for
+from flask import Flask, render_template, request, jsonify, send_file, redirect, url_for, Response, stream_with_context
 from datetime import datetime
 import traceback
-from PyPDF2 import PdfReader
-import pytesseract
-from pdf2image import convert_from_path
-from pymongo import MongoClient 
+import time
+import threading
+import atexit
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import re
-import pandas as pd
-
-# Import your existing modules (keep these as they are)
-try:
-    import ai_rag 
-    from ai_rag import ask_latest_statement
-except ImportError:
-    print("Warning: ai_rag module not found")
-    ask_latest_statement = None
-
-try:
-    from pdf_generator import generate_pdf
-except ImportError:
-    print("Warning: pdf_generator module not found")
-    generate_pdf = None
+
+import bulk
+import db
+import metrics
+import reconcile
+import search_index
+
+# The OCR, PDF and LLM stacks are slow to import, so they are loaded on
+# first use rather than at startup.
 
 UPLOAD_DIR = "uploads"
 MPESA_DIR = "mpesa_statements"
@@ -30,14 +25,46 @@ MPESA_DIR = "mpesa_statements"
 os.makedirs(UPLOAD_DIR, exist_ok=True) 
 os.makedirs(MPESA_DIR, exist_ok=True)
 
-client = MongoClient("mongodb://localhost:27017/")
-db = client["Mledger"]
-statements_col = db["statements"]
-
 app = Flask(__name__)
-pytesseract.pytesseract.tesseract_cmd = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
+tesseract_cmd = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
 poppler_path = r"C:\poppler-23.06.0\Library\bin"
 
+# Pages whose rows fail the balance check are re-OCRed with this profile
+ACCURATE_OCR_DPI = int(os.getenv("ACCURATE_OCR_DPI", "400"))
+ACCURATE_OCR_CONFIG = "--oem 3 --psm 6"
+
+_ingest_lock = threading.Lock()
+
+# CPU-bound extraction (PDF decrypt, OCR, parsing) runs in a small process
+# pool so request threads only wait on it instead of holding the GIL.
+# INGEST_WORKERS=0 runs extraction inline in the calling thread.
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "1"))
+_extract_pool = None
+_extract_pool_lock = threading.Lock()
+
+
+def _load_ocr():
+    """Import and configure pytesseract and pdf2image on first use."""
+    import pytesseract
+    from pdf2image import convert_from_path
+    pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
+    return pytesseract, convert_from_path
+
+
+def ask_latest_statement(question):
+    """Forward to ai_rag, importing the LLM stack on first use."""
+    try:
+        import ai_rag
+    except ImportError:
+        return "AI service is not available: ai_rag module not found."
+    return ai_rag.ask_latest_statement(question)
+
+
+def generate_pdf(transactions, out):
+    """Forward to pdf_generator, importing reportlab on first use."""
+    from pdf_generator import generate_pdf as _generate_pdf
+    return _generate_pdf(transactions, out)
+
 
 @app.template_filter("format_number")
 def format_number(value):
@@ -47,10 +74,11 @@ def format_number(value):
         return value
 
 
-def parse_mpesa_transactions(text):
+def parse_mpesa_transactions(text, page=None):
     """
     Parse M-Pesa statement text and extract transactions with proper categorization.
     This is the FIXED version that correctly categorizes M-Shwari transactions.
+    If page is given, each transaction records the PDF page it came from.
     """
     transactions = []
     
@@ -59,6 +87,7 @@ def parse_mpesa_transactions(text):
     pattern = r'([A-Z0-9]+)\s+(\d{4}-\d{2}-\d{2})\s+(\d{2}:\d{2}:\d{2})\s+(.+?)\s+Completed\s+([-]?[\d,]+\.\d{2})\s+([\d,]+\.\d{2})'
     
     matches = re.findall(pattern, text)
+    pending = []
     
     for match in matches:
         reference, date_str, time_str, transaction_desc, amount_str, balance_str = match
@@ -80,26 +109,34 @@ def parse_mpesa_transactions(text):
         except ValueError:
             continue
         
-        # Determine transaction type and category
-        transaction_type, category, party = categorize_transaction(transaction_desc, amount_value)
-        
         # Amount should always be positive for storage
         amount_abs = abs(amount_value)
         
+        # Type, party and category are filled in by the categorise pass below
         transaction = {
             "datetime": transaction_datetime,
             "date": date_str,
             "time": time_str,
             "reference": reference,
-            "transaction_type": transaction_type,
-            "party": party,
+            "transaction_type": None,
+            "party": None,
             "amount": amount_abs,
-            "category": category,
+            "category": None,
             "balance": balance_value,
+            "signed_amount": amount_value,
             "description": transaction_desc.strip()
         }
+        if page is not None:
+            transaction["page"] = page
         
         transactions.append(transaction)
+        pending.append((transaction_desc, amount_value))
+    
+    # Determine transaction type and category, timed as one block
+    with metrics.timed("categorise"):
+        for transaction, (transaction_desc, amount_value) in zip(transactions, pending):
+            transaction["transaction_type"], transaction["category"], transaction["party"] = \
+                categorize_transaction(transaction_desc, amount_value)
     
     return transactions
 
@@ -242,6 +279,17 @@ def extract_text_from_image_pdf_with_passwords(pdf_path, passwords_dir="password
     Converts pages to images and runs OCR.
     Returns extracted text.
     """
+    pages, _, _ = extract_pages_with_passwords(pdf_path, passwords_dir, poppler_path)
+    return "".join(page_text + "\n" for page_text in pages if page_text)
+
+
+def extract_pages_with_passwords(pdf_path, passwords_dir="passwords", poppler_path=None):
+    """
+    Same as extract_text_from_image_pdf_with_passwords but keeps pages apart.
+    Returns (page_texts, method, password) where method is "text" or "ocr".
+    """
+    from PyPDF2 import PdfReader
+
     passwords = []
     for txt_file in Path(passwords_dir).glob("*.txt"):
         with open(txt_file, "r") as f:
@@ -252,32 +300,33 @@ def extract_text_from_image_pdf_with_passwords(pdf_path, passwords_dir="password
 
     for pwd in passwords:
         try:
-            reader = PdfReader(pdf_path)
-            if reader.is_encrypted:
-                result = reader.decrypt(pwd)
-                if result == 0:
-                    continue
+            with metrics.timed("password_trial"):
+                reader = PdfReader(pdf_path)
+                if reader.is_encrypted:
+                    result = reader.decrypt(pwd)
+                    if result == 0:
+                        continue
 
-            text = ""
-            for page in reader.pages:
-                page_text = page.extract_text()
-                if page_text:
-                    text += page_text + "\n"
+            with metrics.timed("text_extract"):
+                pages = [page.extract_text() or "" for page in reader.pages]
 
-            if text.strip():
+            if any(page_text.strip() for page_text in pages):
                 print(f"Password succeeded (text-based PDF): {pwd}")
-                return text
+                return pages, "text", pwd
 
             # If no text extracted, try OCR
             print(f"Converting PDF to images for OCR: {pdf_path}")
-            images = convert_from_path(pdf_path, poppler_path=poppler_path)
+            pytesseract, convert_from_path = _load_ocr()
+            with metrics.timed("page_render"):
+                images = convert_from_path(pdf_path, poppler_path=poppler_path, userpw=pwd)
 
-            ocr_text = ""
+            pages = []
             for i, image in enumerate(images, start=1):
-                ocr_text += pytesseract.image_to_string(image) + "\n"
+                with metrics.timed("ocr_page"):
+                    pages.append(pytesseract.image_to_string(image))
                 print(f"Processed page {i}/{len(images)}")
             print(f"Password succeeded (OCR): {pwd}")
-            return ocr_text
+            return pages, "ocr", pwd
 
         except Exception as e:
             print(f"Error with password {pwd}: {e}")
@@ -286,61 +335,290 @@ def extract_text_from_image_pdf_with_passwords(pdf_path, passwords_dir="password
     raise Exception(f"All passwords failed. Could not open PDF: {pdf_path}")
 
 
+def reocr_pages(pdf_path, password, page_numbers, poppler_path=None, dpi=ACCURATE_OCR_DPI):
+    """
+    OCR only the given 1-based pages at high DPI with grayscale + median
+    filter preprocessing. Returns {page_number: text}.
+    """
+    from PIL import ImageFilter
+
+    pytesseract, convert_from_path = _load_ocr()
+    texts = {}
+    for page_number in page_numbers:
+        with metrics.timed("page_render"):
+            images = convert_from_path(pdf_path, dpi=dpi, first_page=page_number, last_page=page_number,
+                                       poppler_path=poppler_path, userpw=password)
+        if not images:
+            continue
+        with metrics.timed("reocr_page"):
+            image = images[0].convert("L").filter(ImageFilter.MedianFilter())
+            texts[page_number] = pytesseract.image_to_string(image, config=ACCURATE_OCR_CONFIG)
+    return texts
+
+
+def _parse_pages(pages):
+    transactions = []
+    for page_number, page_text in enumerate(pages, start=1):
+        transactions.extend(parse_mpesa_transactions(page_text, page=page_number))
+    return transactions
+
+
 def auto_ingest_mpesa_statements():
     """
     Auto-ingest PDFs from the statements directory.
     Now with CORRECT parsing and totals calculation.
+    Only one ingest runs at a time; overlapping calls return immediately.
     """
+    if not _ingest_lock.acquire(blocking=False):
+        print("Ingest already running, skipping")
+        return
+    try:
+        _ingest_new_statements()
+    finally:
+        _ingest_lock.release()
+
+
+def _ingest_and_index():
+    auto_ingest_mpesa_statements()
+    search_index.start_background()
+
+
+def start_background_ingest():
+    """Run auto_ingest_mpesa_statements in a daemon thread, then build the search index."""
+    thread = threading.Thread(target=_ingest_and_index, name="mledger-ingest", daemon=True)
+    thread.start()
+    return thread
+
+
+def _number_stored_rows(statements_col):
+    """Give statements stored before rows carried seq their chronological order."""
+    query = {"transactions.0": {"$exists": True}, "transactions.0.seq": {"$exists": False}}
+    for statement in statements_col.find(query, {"transactions": 1}):
+        transactions = statement["transactions"]
+        reconcile.number_rows(transactions)
+        statements_col.update_one({"_id": statement["_id"]}, {"$set": {"transactions": transactions}})
+
+
+def _ingest_new_statements():
+    statements_col = db.statements_collection()
+    try:
+        _number_stored_rows(statements_col)
+    except Exception as e:
+        print(f"Could not number stored statement rows: {e}")
     for pdf_file in Path(MPESA_DIR).glob("*.pdf"):
         # Skip if already processed
         if statements_col.find_one({"filename": pdf_file.name}):
             print(f"Skipping {pdf_file.name} - already in database")
             continue
 
-        try:
-            print(f"Processing: {pdf_file.name}")
+        with metrics.file_context(pdf_file.name):
+            ingest_start = time.perf_counter()
+            try:
+                print(f"Processing: {pdf_file.name}")
 
-            # Extract text from PDF
-            text = extract_text_from_image_pdf_with_passwords(
-                str(pdf_file),
-                passwords_dir="passwords",
-                poppler_path=poppler_path
-            )
+                # Extract text and parse transactions
+                transactions = run_extraction(str(pdf_file), pdf_file.name)
 
-            # Parse transactions with FIXED logic
-            transactions = parse_mpesa_transactions(text)
+                if not transactions:
+                    print(f"No transactions found in {pdf_file.name}, skipping.")
+                    metrics.inc("ingest_total", status="empty")
+                    metrics.log_ingest(pdf_file.name, "empty",
+                                       total_seconds=time.perf_counter() - ingest_start)
+                    continue
 
-            if not transactions:
-                print(f"No transactions found in {pdf_file.name}, skipping.")
+                # Calculate totals
+                totals = calculate_totals(transactions)
+
+                # Store in MongoDB
+                statement = {
+                    "filename": pdf_file.name,
+                    "account": bulk.account_from_filename(pdf_file.name),
+                    "uploaded_at": datetime.utcnow(),
+                    "transactions": transactions,
+                    "totals": totals
+                }
+                with metrics.timed("mongo_write"):
+                    stored = db.store_statement(statement)
+                if not stored:
+                    # Stored by an upload while this file was being processed
+                    print(f"Skipping {pdf_file.name} - stored meanwhile")
+                    metrics.inc("ingest_total", status="duplicate")
+                    metrics.log_ingest(pdf_file.name, "duplicate",
+                                       total_seconds=time.perf_counter() - ingest_start)
+                    continue
+                search_index.add_statement(statement)
+
+                metrics.inc("ingest_total", status="ok")
+                metrics.log_ingest(pdf_file.name, "ok",
+                                   transactions=len(transactions),
+                                   balance_breaks=sum(not t.get("balance_ok", True) for t in transactions),
+                                   total_seconds=time.perf_counter() - ingest_start)
+
+                print(f" Successfully ingested: {pdf_file.name}")
+                print(f"   Transactions: {len(transactions)}")
+                print(f"   Income: {totals['income']:.2f}")
+                print(f"   Expenses: {totals['expenses']:.2f}")
+                print(f"   Charges: {totals['charges']:.2f}")
+                print(f"   Balance: {totals['balance']:.2f}")
+
+            except Exception as e:
+                print(f" Failed to process {pdf_file.name}: {e}")
+                traceback.print_exc()
+                metrics.inc("ingest_total", status="error")
+                metrics.log_ingest(pdf_file.name, "error", error=str(e),
+                                   total_seconds=time.perf_counter() - ingest_start)
                 continue
 
-            # Calculate totals
-            totals = calculate_totals(transactions)
 
-            # Store in MongoDB
-            statements_col.insert_one({
-                "filename": pdf_file.name,
-                "uploaded_at": datetime.utcnow(),
-                "transactions": transactions,
-                "totals": totals
-            })
+def get_extract_pool():
+    """Return the extraction process pool, creating it on first use."""
+    global _extract_pool
+    if _extract_pool is None:
+        with _extract_pool_lock:
+            if _extract_pool is None:
+                # spawn, not fork: request workers are multi-threaded
+                ctx = multiprocessing.get_context("spawn")
+                _extract_pool = ProcessPoolExecutor(max_workers=INGEST_WORKERS, mp_context=ctx)
+                atexit.register(_extract_pool.shutdown, wait=False)
+    return _extract_pool
 
-            print(f" Successfully ingested: {pdf_file.name}")
-            print(f"   Transactions: {len(transactions)}")
-            print(f"   Income: {totals['income']:.2f}")
-            print(f"   Expenses: {totals['expenses']:.2f}")
-            print(f"   Charges: {totals['charges']:.2f}")
-            print(f"   Balance: {totals['balance']:.2f}")
 
-        except Exception as e:
-            print(f" Failed to process {pdf_file.name}: {e}")
-            traceback.print_exc()
-            continue
+def extract_and_parse(pdf_path, filename):
+    """
+    Extract and parse one statement. Stage timings go to the caller's
+    metrics.file_context.
+    """
+    pages, method, password = extract_pages_with_passwords(
+        pdf_path,
+        passwords_dir="passwords",
+        poppler_path=poppler_path
+    )
+
+    # Parse transactions with FIXED logic
+    with metrics.timed("parse"):
+        transactions = _parse_pages(pages)
+
+    # Check running balances; re-OCR only the pages with broken rows
+    with metrics.timed("reconcile"):
+        breaks = reconcile.find_balance_breaks(transactions)
+
+    if breaks and method == "ocr":
+        recheck = reconcile.pages_to_recheck(transactions, breaks)
+        print(f"{len(breaks)} balance breaks in {filename}, re-OCRing pages {recheck}")
+        improved = list(pages)
+        for page_number, text in reocr_pages(pdf_path, password, recheck, poppler_path).items():
+            improved[page_number - 1] = text
+
+        with metrics.timed("parse"):
+            candidate = _parse_pages(improved)
+        with metrics.timed("reconcile"):
+            candidate_breaks = reconcile.find_balance_breaks(candidate)
+        if candidate and len(candidate_breaks) < len(breaks):
+            transactions = candidate
+
+    with metrics.timed("reconcile"):
+        breaks = reconcile.flag_balance_breaks(transactions)
+        reconcile.number_rows(transactions)
+    if breaks:
+        print(f"{len(breaks)} rows in {filename} still fail the balance check")
+
+    return transactions
+
+
+def _extract_and_parse_captured(pdf_path, filename):
+    """Pool entry point: returns (transactions, raw stage observations)."""
+    with metrics.capture() as observations:
+        transactions = extract_and_parse(pdf_path, filename)
+    return transactions, observations
+
+
+def run_extraction(pdf_path, filename):
+    """Run extract_and_parse in the extraction pool and return the transactions."""
+    if INGEST_WORKERS <= 0:
+        return extract_and_parse(pdf_path, filename)
+
+    # Replay the worker's observations one by one so per-page/per-trial
+    # histograms keep one sample per page or trial
+    future = get_extract_pool().submit(_extract_and_parse_captured, pdf_path, filename)
+    transactions, observations = future.result()
+    metrics.replay(observations, filename)
+    return transactions
+
+
+def run_ingest_process():
+    """
+    Entry point for a dedicated ingest process (see gunicorn.conf.py).
+    The whole process is already off the request path, so extract inline.
+    """
+    global INGEST_WORKERS
+    INGEST_WORKERS = 0
+    auto_ingest_mpesa_statements()
 
 
 def get_latest_statement():
     """Return the most recently uploaded statement."""
-    return statements_col.find_one({}, sort=[("uploaded_at", -1)])
+    return db.statements_collection().find_one({}, sort=[("uploaded_at", -1)])
+
+
+def filter_statement_transactions(transactions, type_filter="all", start_date=None, end_date=None):
+    """
+    Filter stored transactions by category and YYYY-MM-DD date range.
+    Returns rows shaped for the dashboard table.
+    """
+    result = []
+
+    for t in transactions:
+        tx_category = (t.get("category") or "").lower()
+        tx_date_str = t.get("date")
+        tx_amount = t.get("amount") or 0
+        tx_balance = t.get("balance") or 0
+        tx_description = t.get("description") or "-"
+        tx_type = t.get("transaction_type") or "-"
+
+        # Skip if no valid date
+        if not tx_date_str:
+            continue
+        
+        try:
+            tx_date = datetime.strptime(tx_date_str, "%Y-%m-%d")
+        except ValueError:
+            continue
+
+        # Type filter
+        if type_filter != "all" and tx_category != type_filter:
+            continue
+
+        # Date range filter
+        if start_date:
+            try:
+                start_dt = datetime.strptime(start_date, "%Y-%m-%d")
+                if tx_date < start_dt:
+                    continue
+            except ValueError:
+                pass
+        
+        if end_date:
+            try:
+                end_dt = datetime.strptime(end_date, "%Y-%m-%d")
+                if tx_date > end_dt:
+                    continue
+            except ValueError:
+                pass
+
+        # Add transaction to result
+        result.append({
+            "date": tx_date_str,
+            "time": t.get("time") or "-",
+            "reference": t.get("reference") or "-",
+            "description": tx_description,
+            "type": tx_type,
+            "category": tx_category,
+            "amount": tx_amount,
+            "balance": tx_balance,
+            "party": t.get("party") or "-"
+        })
+
+    return result
 
 
 @app.route("/", methods=["GET", "POST"])
@@ -350,42 +628,50 @@ def index():
         if not file:
             return "No file uploaded", 400
 
-        os.makedirs(MPESA_DIR, exist_ok=True)
-        path = os.path.join(MPESA_DIR, file.filename)
+        # Kept out of MPESA_DIR until stored, so auto-ingest can't pick it up too
+        os.makedirs(UPLOAD_DIR, exist_ok=True)
+        path = os.path.join(UPLOAD_DIR, file.filename)
         file.save(path)
 
         try:
-            # Extract text
-            text = extract_text_from_image_pdf_with_passwords(
-                path,
-                passwords_dir="passwords",
-                poppler_path=poppler_path
-            )
-            
-            # Parse with FIXED logic
-            transactions = parse_mpesa_transactions(text)
-
-            if not transactions:
-                return "No transactions found in the uploaded file", 400
-
-            # Calculate totals
-            totals = calculate_totals(transactions)
-
-            # Store in MongoDB
-            statements_col.insert_one({
-                "filename": file.filename,
-                "uploaded_at": datetime.utcnow(),
-                "transactions": transactions,
-                "totals": totals
-            })
+            with metrics.file_context(file.filename):
+                # Extract text and parse transactions
+                transactions = run_extraction(path, file.filename)
+
+                if not transactions:
+                    metrics.log_ingest(file.filename, "empty", source="upload")
+                    return "No transactions found in the uploaded file", 400
+
+                # Calculate totals
+                totals = calculate_totals(transactions)
+
+                # Store in MongoDB
+                statement = {
+                    "filename": file.filename,
+                    "account": bulk.account_from_filename(file.filename),
+                    "uploaded_at": datetime.utcnow(),
+                    "transactions": transactions,
+                    "totals": totals
+                }
+                with metrics.timed("mongo_write"):
+                    db.store_statement(statement, replace=True)
+                search_index.add_statement(statement)
+                os.makedirs(MPESA_DIR, exist_ok=True)
+                os.replace(path, os.path.join(MPESA_DIR, file.filename))
+
+                metrics.log_ingest(file.filename, "ok", source="upload",
+                                   transactions=len(transactions),
+                                   balance_breaks=sum(not t.get("balance_ok", True) for t in transactions))
 
             return redirect(url_for("index"))
 
         except Exception as e:
+            metrics.log_ingest(file.filename, "error", source="upload", error=str(e))
             return f"Error processing file: {str(e)}", 500
 
     # Get latest statement
-    latest = statements_col.find_one({}, sort=[("uploaded_at", -1)])
+    with metrics.timed("query"):
+        latest = get_latest_statement()
 
     if not latest:
         return render_template(
@@ -432,67 +718,119 @@ def filter_transactions():
         end_date = payload.get("end_date")
 
         # Load transactions from MongoDB
-        latest = statements_col.find_one({}, sort=[("uploaded_at", -1)])
+        with metrics.timed("query"):
+            latest = get_latest_statement()
         transactions = latest.get("transactions", []) if latest else []
 
-        result = []
+        result = filter_statement_transactions(transactions, type_filter, start_date, end_date)
 
-        for t in transactions:
-            tx_category = (t.get("category") or "").lower()
-            tx_date_str = t.get("date")
-            tx_amount = t.get("amount") or 0
-            tx_balance = t.get("balance") or 0
-            tx_description = t.get("description") or "-"
-            tx_type = t.get("transaction_type") or "-"
+        return jsonify({"transactions": result})
 
-            # Skip if no valid date
-            if not tx_date_str:
-                continue
-            
-            try:
-                tx_date = datetime.strptime(tx_date_str, "%Y-%m-%d")
-            except ValueError:
-                continue
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({"transactions": [], "error": str(e)}), 500
 
-            # Type filter
-            if type_filter != "all" and tx_category != type_filter:
-                continue
 
-            # Date range filter
-            if start_date:
-                try:
-                    start_dt = datetime.strptime(start_date, "%Y-%m-%d")
-                    if tx_date < start_dt:
-                        continue
-                except ValueError:
-                    pass
-            
-            if end_date:
-                try:
-                    end_dt = datetime.strptime(end_date, "%Y-%m-%d")
-                    if tx_date > end_dt:
-                        continue
-                except ValueError:
-                    pass
-
-            # Add transaction to result
-            result.append({
-                "date": tx_date_str,
-                "time": t.get("time") or "-",
-                "reference": t.get("reference") or "-",
-                "description": tx_description,
-                "type": tx_type,
-                "category": tx_category,
-                "amount": tx_amount,
-                "balance": tx_balance,
-                "party": t.get("party") or "-"
-            })
+@app.route("/statement_data")
+def statement_data():
+    """Latest statement's metadata, totals and transactions as JSON"""
+    with metrics.timed("query"):
+        latest = get_latest_statement()
 
-        return jsonify({"transactions": result})
+    if not latest:
+        return jsonify({"filename": None, "uploaded_at": None, "totals": {}, "transactions": []})
+
+    return jsonify({
+        "filename": latest.get("filename"),
+        "uploaded_at": latest.get("uploaded_at"),
+        "totals": latest.get("totals", {}),
+        "transactions": latest.get("transactions", [])
+    })
 
+
+@app.route("/search")
+def search():
+    """Token, prefix and fuzzy search over descriptions and parties in all statements"""
+    query = request.args.get("q", "").strip()
+    direction = request.args.get("direction", "all").lower()
+    try:
+        limit = max(1, min(int(request.args.get("limit", 50)), 500))
+    except ValueError:
+        limit = 50
+
+    if not query:
+        return jsonify({"query": query, "results": []})
+
+    try:
+        start = time.perf_counter()
+        results = search_index.search(query, limit=limit, direction=direction)
+        took_ms = (time.perf_counter() - start) * 1000
+        metrics.observe("search", took_ms / 1000)
+        return jsonify({"query": query, "results": results, "took_ms": round(took_ms, 3)})
     except Exception as e:
         traceback.print_exc()
-        return jsonify({"transactions": [], "error": str(e)}), 500
+        return jsonify({"query": query, "results": [], "error": str(e)}), 500
+
+
+@app.route("/bulk_totals", methods=["POST"])
+def bulk_totals():
+    """
+    Totals and rollups for many accounts and date ranges in one call.
+
+    Body: {"queries": [{"account", "start_date", "end_date"}, ...],
+           "group_by": "none" | "month" | "day", "format": "csv" | "ndjson"}
+    Instead of "queries", "accounts" (default: every known account) with a
+    shared "start_date"/"end_date" may be given.
+    """
+    payload = request.get_json(force=True, silent=True)
+    if payload is None:
+        payload = {}
+    if not isinstance(payload, dict):
+        return jsonify({"error": "body must be a JSON object"}), 400
+
+    group_by = payload.get("group_by") or "none"
+    output = payload.get("format") or request.args.get("format") or "ndjson"
+    if not isinstance(group_by, str) or not isinstance(output, str):
+        return jsonify({"error": "group_by and format must be strings"}), 400
+    group_by = group_by.lower()
+    output = output.lower()
+
+    if group_by not in bulk.GROUP_BY:
+        return jsonify({"error": f"group_by must be one of {sorted(bulk.GROUP_BY)}"}), 400
+    if output not in ("csv", "ndjson"):
+        return jsonify({"error": "format must be csv or ndjson"}), 400
+
+    queries = payload.get("queries")
+    if queries is None:
+        accounts = payload.get("accounts")
+        if accounts is not None and (not isinstance(accounts, list)
+                                     or not all(isinstance(a, str) for a in accounts)):
+            return jsonify({"error": "accounts must be a list of strings"}), 400
+        try:
+            accounts = accounts or bulk.list_accounts()
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+        queries = [
+            {"account": account, "start_date": payload.get("start_date"), "end_date": payload.get("end_date")}
+            for account in accounts
+        ]
+
+    if not isinstance(queries, list) or not all(isinstance(q, dict) for q in queries):
+        return jsonify({"error": "queries must be a list of objects"}), 400
+    if len(queries) > bulk.MAX_QUERIES:
+        return jsonify({"error": f"at most {bulk.MAX_QUERIES} queries per call"}), 400
+    for i, q in enumerate(queries):
+        if q.get("account") is not None and not isinstance(q.get("account"), str):
+            return jsonify({"error": f"queries[{i}].account must be a string"}), 400
+        for field in ("start_date", "end_date"):
+            if not bulk.validate_date(q.get(field)):
+                return jsonify({"error": f"queries[{i}].{field} must be YYYY-MM-DD"}), 400
+
+    rows = bulk.run_bulk(queries, group_by)
+    if output == "csv":
+        return Response(stream_with_context(bulk.stream_csv(rows)), mimetype="text/csv",
+                        headers={"Content-Disposition": "attachment; filename=bulk_totals.csv"})
+    return Response(stream_with_context(bulk.stream_ndjson(rows)), mimetype="application/x-ndjson")
 
 
 @app.route("/download_pdf")
@@ -500,35 +838,44 @@ def download_pdf():
     """Generate PDF report of transactions"""
     try:
         # Get latest statement
-        latest = statements_col.find_one({}, sort=[("uploaded_at", -1)])
+        with metrics.timed("query"):
+            latest = get_latest_statement()
         
         if not latest:
             return "No statements found", 404
         
         transactions = latest.get("transactions", [])
         
-        if generate_pdf:
-            out = "report.pdf"
-            generate_pdf(transactions, out)
-            return send_file(out, as_attachment=True)
-        else:
+        out = "report.pdf"
+        try:
+            with metrics.timed("pdf_build"):
+                generate_pdf(transactions, out)
+        except ImportError:
             return "PDF generation not available", 500
+        return send_file(out, as_attachment=True)
             
     except Exception as e:
         return f"Error generating PDF: {str(e)}", 500
 
 
+@app.route("/metrics")
+def metrics_endpoint():
+    """Prometheus-style per-stage latency histograms"""
+    return Response(metrics.render_prometheus(), mimetype="text/plain; version=0.0.4")
+
+
 if __name__ == "__main__":
     print("=" * 80)
     print("M-PESA STATEMENT PROCESSOR - FIXED VERSION")
     print("=" * 80)
-    print("\nAuto-ingesting statements from:", MPESA_DIR)
+    print("\nAuto-ingesting statements in the background from:", MPESA_DIR)
     print()
     
-    auto_ingest_mpesa_statements()
+    start_background_ingest()
     
     print("\n" + "=" * 80)
-    print("Starting Flask application...")
+    print("Starting Flask development server...")
+    print("For production use: gunicorn -c gunicorn.conf.py wsgi:app")
     print("=" * 80)
     
-    app.run(debug=True, use_reloader=False)
\ No newline at end of file
+    app.run(debug=os.getenv("FLASK_DEBUG", "1") == "1", use_reloader=False)
\ No newline at end of file
@@ -0,0 +1,199 @@
+"""
+ASGI entry point with async versions of the I/O-bound endpoints.
+
+    gunicorn -c gunicorn.conf.py -k uvicorn.workers.UvicornWorker asgi:app
+    uvicorn asgi:app --workers 4
+
+/ai_chat, /filter_transactions and /statement_data are served natively on the
+event loop using Motor for Mongo and httpx for Ollama, so a slow model call no
+longer ties up a worker. Each has its own concurrency limit and wait queue;
+when the queue is full the endpoint answers 503 with Retry-After instead of
+piling up requests. Every other route falls through to the Flask app.
+"""
+import asyncio
+import json
+import os
+
+import httpx
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import Response
+from starlette.routing import Mount, Route
+
+import ai_rag
+import db
+import metrics
+from app import app as flask_app, filter_statement_transactions
+
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "120"))
+
+
+class Overloaded(Exception):
+    pass
+
+
+class ConcurrencyLimiter:
+    """
+    Allow `limit` requests at once and at most `max_waiting` queued behind them.
+    Queued requests give up after `wait_timeout` seconds.
+    """
+
+    def __init__(self, name, limit, max_waiting, wait_timeout):
+        self.name = name
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self.wait_timeout = wait_timeout
+        self.waiting = 0
+        self._semaphore = None
+
+    async def __aenter__(self):
+        # Created lazily so it binds to the worker's running loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.limit)
+        if self._semaphore.locked() and self.waiting >= self.max_waiting:
+            metrics.inc("rejected_total", endpoint=self.name)
+            raise Overloaded(self.name)
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.wait_timeout)
+        except asyncio.TimeoutError:
+            metrics.inc("rejected_total", endpoint=self.name)
+            raise Overloaded(self.name)
+        finally:
+            self.waiting -= 1
+        return self
+
+    async def __aexit__(self, *exc):
+        self._semaphore.release()
+
+
+def _limiter(name, limit, max_waiting, wait_timeout):
+    prefix = name.upper()
+    return ConcurrencyLimiter(
+        name,
+        int(os.getenv(f"{prefix}_CONCURRENCY", limit)),
+        int(os.getenv(f"{prefix}_QUEUE", max_waiting)),
+        float(os.getenv(f"{prefix}_QUEUE_TIMEOUT", wait_timeout)),
+    )
+
+
+chat_limiter = _limiter("chat", 2, 8, 30)
+filter_limiter = _limiter("filter", 32, 128, 5)
+statement_limiter = _limiter("statement", 32, 128, 5)
+
+_http_client = None
+
+
+def get_http_client():
+    """Shared httpx client for Ollama, created inside the running loop."""
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(base_url=ai_rag.OLLAMA_BASE_URL, timeout=LLM_TIMEOUT)
+    return _http_client
+
+
+def _json(data, status_code=200, headers=None):
+    # Flask's JSON provider, so dates come out exactly as in the WSGI routes
+    body = flask_app.json.dumps(data)
+    return Response(body, status_code=status_code, media_type="application/json", headers=headers)
+
+
+def _overloaded(payload):
+    return _json(payload, status_code=503, headers={"Retry-After": "2"})
+
+
+async def _latest_statement(projection=None):
+    with metrics.timed("query"):
+        return await db.async_statements_collection().find_one(
+            {}, projection, sort=[("uploaded_at", -1)]
+        )
+
+
+async def ai_chat(request):
+    """Async AI chat: one Mongo read, then one non-blocking Ollama call"""
+    form = await request.form()
+    question = (form.get("question") or "").strip()
+    if not question:
+        return _json({"answer": "No question provided."})
+
+    try:
+        async with chat_limiter:
+            stmt = await _latest_statement({"_id": 0})
+            if not stmt:
+                return _json({"answer": "No statement found. Please upload a statement first."})
+
+            prompt = ai_rag.build_prompt(stmt, question)
+            with metrics.timed("llm_call"):
+                resp = await get_http_client().post(
+                    "/api/generate",
+                    json={"model": ai_rag.OLLAMA_MODEL, "prompt": prompt, "stream": False},
+                )
+            resp.raise_for_status()
+            return _json({"answer": resp.json().get("response", "")})
+    except Overloaded:
+        return _overloaded({"answer": "The assistant is busy, please try again shortly."})
+    except Exception as e:
+        return _json({"answer": f"AI error: {str(e)}"}, status_code=500)
+
+
+async def filter_transactions(request):
+    """Async filter by type and date range over the latest statement"""
+    try:
+        payload = json.loads(await request.body() or b"{}")
+    except ValueError:
+        payload = {}
+
+    try:
+        async with filter_limiter:
+            latest = await _latest_statement({"_id": 0, "transactions": 1})
+            transactions = latest.get("transactions", []) if latest else []
+            # strptime over every row; keep it off the event loop
+            result = await run_in_threadpool(
+                filter_statement_transactions,
+                transactions,
+                (payload.get("type_filter") or "all").lower(),
+                payload.get("start_date"),
+                payload.get("end_date"),
+            )
+            return _json({"transactions": result})
+    except Overloaded:
+        return _overloaded({"transactions": [], "error": "Server busy"})
+    except Exception as e:
+        return _json({"transactions": [], "error": str(e)}, status_code=500)
+
+
+async def statement_data(request):
+    """Latest statement's metadata, totals and transactions as JSON"""
+    try:
+        async with statement_limiter:
+            latest = await _latest_statement({"_id": 0})
+    except Overloaded:
+        return _overloaded({"error": "Server busy"})
+
+    if not latest:
+        return _json({"filename": None, "uploaded_at": None, "totals": {}, "transactions": []})
+
+    # Encoding every transaction is CPU-bound; keep it off the event loop
+    return await run_in_threadpool(_json, {
+        "filename": latest.get("filename"),
+        "uploaded_at": latest.get("uploaded_at"),
+        "totals": latest.get("totals", {}),
+        "transactions": latest.get("transactions", []),
+    })
+
+
+async def _shutdown():
+    if _http_client is not None:
+        await _http_client.aclose()
+
+
+app = Starlette(
+    routes=[
+        Route("/ai_chat", ai_chat, methods=["POST"]),
+        Route("/filter_transactions", filter_transactions, methods=["POST"]),
+        Route("/statement_data", statement_data, methods=["GET"]),
+        Mount("/", WSGIMiddleware(flask_app)),
+    ],
+    on_shutdown=[_shutdown],
+)
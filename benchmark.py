@@ -0,0 +1,434 @@
+"""
+Offline benchmark harness for the M-Ledger ingest and query paths.
+
+Measures throughput, peak memory and, for stages timed per operation
+(categorise, query), latency percentiles for:
+  - extract     text extraction from PDFs (synthetic + mpesa_statements/)
+  - parse       parse_mpesa_transactions
+  - categorise  categorize_transaction
+  - totals      calculate_totals
+  - mongo_write statement insert (mongomock stand-in)
+  - query       /filter_transactions round trip (Flask test client)
+
+No network is needed: Mongo is replaced by mongomock (requirements-dev.txt)
+and synthetic statements are generated locally.
+
+Usage:
+    python benchmark.py                          # 1k,10k,100k rows
+    python benchmark.py --sizes 1000,1000000     # custom sizes
+    python benchmark.py --save-baseline          # store results as the baseline
+    python benchmark.py --compare                # fail on regressions vs baseline
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import app
+import db
+
+BASELINE_FILE = "benchmark_baseline.json"
+DEFAULT_SIZES = [1_000, 10_000, 100_000]
+DEFAULT_PDF_SIZES = [1_000]
+DEFAULT_TOLERANCE = 0.20
+
+# Descriptions chosen so every branch of categorize_transaction gets exercised
+SYNTHETIC_DESCRIPTIONS = [
+    ("M-Shwari Withdraw", 1),
+    ("M-Shwari Deposit", -1),
+    ("Airtime Purchase 0712345678", -1),
+    ("Pay Bill to 888880 KPLC PREPAID", -1),
+    ("Pay Bill Charge", -1),
+    ("Customer Withdrawal At Agent 123456", -1),
+    ("Withdrawal Charge", -1),
+    ("Send Money to JOHN DOE 0712345678", -1),
+    ("Funds received from JANE WANJIKU 0722000111", 1),
+    ("Buy Goods from 5544 JAVA HOUSE", -1),
+    ("Buy Goods Charge", -1),
+    ("HELB Loan Repayment", -1),
+    ("Savings Contribution", -1),
+    ("OverDraft of Credit Party Fuliza", 1),
+    ("Fuliza Repayment", -1),
+]
+
+
+# ---------------------------------------------------------------------------
+# Synthetic data
+# ---------------------------------------------------------------------------
+
+def _reference(rng):
+    alphabet = "ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"
+    return "".join(rng.choice(alphabet) for _ in range(10))
+
+
+def generate_statement_lines(rows, seed=42):
+    """Generate `rows` M-Pesa statement lines with a consistent running balance."""
+    rng = random.Random(seed)
+    balance = 50_000.00
+    start = datetime(2026, 1, 1)
+    lines = []
+    for i in range(rows):
+        desc, sign = rng.choice(SYNTHETIC_DESCRIPTIONS)
+        amount = round(rng.uniform(1, 5_000), 2)
+        if sign < 0 and amount > balance:
+            sign = 1
+        balance = round(balance + sign * amount, 2)
+        ts = start + timedelta(seconds=i * 37)
+        lines.append(
+            f"{_reference(rng)} {ts:%Y-%m-%d %H:%M:%S} {desc} Completed "
+            f"{sign * amount:,.2f} {balance:,.2f}"
+        )
+    return lines
+
+
+def generate_statement_text(rows, seed=42):
+    return "\n".join(generate_statement_lines(rows, seed)) + "\n"
+
+
+def generate_statement_pdf(rows, out_path, seed=42):
+    """Write a text-based synthetic statement PDF using reportlab."""
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfgen import canvas
+
+    c = canvas.Canvas(out_path, pagesize=A4)
+    width, height = A4
+    y = height - 40
+    c.setFont("Helvetica", 7)
+    for line in generate_statement_lines(rows, seed):
+        c.drawString(20, y, line)
+        y -= 10
+        if y < 40:
+            c.showPage()
+            c.setFont("Helvetica", 7)
+            y = height - 40
+    c.save()
+    return out_path
+
+
+# ---------------------------------------------------------------------------
+# Measurement helpers
+# ---------------------------------------------------------------------------
+
+def _percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    k = (len(ordered) - 1) * pct / 100
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def measure(fn, repeat=3, reset=None):
+    """
+    Run fn() once under tracemalloc for peak memory, then `repeat` untraced
+    runs for durations, so tracing overhead never reaches the timings.
+    reset() is called between the two phases to discard per-op samples.
+    Returns (last_result, durations_s, peak_bytes).
+    """
+    tracemalloc.start()
+    try:
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    if reset:
+        reset()
+
+    durations = []
+    result = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        durations.append(time.perf_counter() - t0)
+    return result, durations, peak
+
+
+def _latency_ms(samples, pct):
+    # A handful of whole-run samples says nothing about tail latency
+    if not samples:
+        return None
+    return round(_percentile(samples, pct) * 1000, 4)
+
+
+def summarize(stage, size, rows, durations, peak, per_op=None):
+    """
+    Build a result record. per_op are individual op latencies in seconds;
+    stages without them report no percentiles, only best time and throughput.
+    """
+    best = min(durations) if durations else 0.0
+    return {
+        "stage": stage,
+        "size": size,
+        "rows": rows,
+        "best_s": round(best, 6),
+        "rows_per_s": round(rows / best, 1) if best else 0.0,
+        "p50_ms": _latency_ms(per_op, 50),
+        "p95_ms": _latency_ms(per_op, 95),
+        "p99_ms": _latency_ms(per_op, 99),
+        "peak_mb": round(peak / (1024 * 1024), 3),
+    }
+
+
+# ---------------------------------------------------------------------------
+# Mongo stand-in
+# ---------------------------------------------------------------------------
+
+def use_mongomock():
+    """Swap the shared Mongo client for an in-memory mongomock client."""
+    import mongomock
+    db.use_client(mongomock.MongoClient())
+    return db.statements_collection()
+
+
+# ---------------------------------------------------------------------------
+# Stages
+# ---------------------------------------------------------------------------
+
+def bench_parse(size, repeat):
+    text = generate_statement_text(size)
+    txs, durations, peak = measure(lambda: app.parse_mpesa_transactions(text), repeat)
+    return summarize("parse", size, len(txs), durations, peak), txs
+
+
+def bench_categorise(size, repeat):
+    rng = random.Random(7)
+    samples = [rng.choice(SYNTHETIC_DESCRIPTIONS) for _ in range(size)]
+    per_op = []
+
+    def run():
+        per_op.clear()
+        for desc, sign in samples:
+            t0 = time.perf_counter()
+            app.categorize_transaction(desc, sign * 100.0)
+            per_op.append(time.perf_counter() - t0)
+
+    _, durations, peak = measure(run, repeat)
+    return summarize("categorise", size, size, durations, peak, per_op)
+
+
+def bench_totals(size, txs, repeat):
+    _, durations, peak = measure(lambda: app.calculate_totals(txs), repeat)
+    return summarize("totals", size, len(txs), durations, peak)
+
+
+def bench_mongo_write(size, txs, totals, col, repeat):
+    def run():
+        col.delete_many({})
+        col.insert_one({
+            "filename": f"bench_{size}.pdf",
+            "uploaded_at": datetime.utcnow(),
+            "transactions": txs,
+            "totals": totals,
+        })
+
+    _, durations, peak = measure(run, repeat)
+    return summarize("mongo_write", size, len(txs), durations, peak)
+
+
+def bench_query(size, rows, repeat, requests_per_run=20):
+    """Hit /filter_transactions through the Flask test client."""
+    client = app.app.test_client()
+    payloads = [
+        {"type_filter": "all"},
+        {"type_filter": "income"},
+        {"type_filter": "expense", "start_date": "2026-01-02", "end_date": "2026-01-20"},
+        {"type_filter": "charge", "start_date": "2026-01-05"},
+    ]
+    per_op = []
+
+    def run():
+        for i in range(requests_per_run):
+            t0 = time.perf_counter()
+            resp = client.post("/filter_transactions", json=payloads[i % len(payloads)])
+            per_op.append(time.perf_counter() - t0)
+            if resp.status_code != 200:
+                raise RuntimeError(f"/filter_transactions returned {resp.status_code}")
+
+    _, durations, peak = measure(run, repeat, reset=per_op.clear)
+    # Throughput for the query stage is rows scanned per second
+    result = summarize("query", size, rows * requests_per_run, durations, peak, per_op)
+    return result
+
+
+def bench_extract_pdf(size, repeat, workdir):
+    pdf_path = os.path.join(workdir, f"synthetic_{size}.pdf")
+    generate_statement_pdf(size, pdf_path)
+
+    def run():
+        return app.extract_text_from_image_pdf_with_passwords(
+            pdf_path, passwords_dir="passwords", poppler_path=app.poppler_path
+        )
+
+    text, durations, peak = measure(run, repeat)
+    rows = len(app.parse_mpesa_transactions(text))
+    return summarize("extract_synthetic", size, rows, durations, peak)
+
+
+def bench_extract_samples(repeat):
+    """Extract every anonymised sample statement; each file is its own record."""
+    results = []
+    for pdf_file in sorted(Path(app.MPESA_DIR).glob("*.pdf")):
+        def run(path=str(pdf_file)):
+            return app.extract_text_from_image_pdf_with_passwords(
+                path, passwords_dir="passwords", poppler_path=app.poppler_path
+            )
+
+        try:
+            text, durations, peak = measure(run, repeat)
+        except Exception as e:
+            print(f"  Skipping {pdf_file.name}: {e}")
+            continue
+        rows = len(app.parse_mpesa_transactions(text))
+        record = summarize("extract_sample", pdf_file.name, rows, durations, peak)
+        results.append(record)
+    return results
+
+
+# ---------------------------------------------------------------------------
+# Baseline comparison
+# ---------------------------------------------------------------------------
+
+def _key(record):
+    return f"{record['stage']}:{record['size']}"
+
+
+def save_baseline(results, path=BASELINE_FILE):
+    with open(path, "w") as f:
+        json.dump({_key(r): r for r in results}, f, indent=2)
+    print(f"Baseline saved to {path}")
+
+
+def compare_baseline(results, path=BASELINE_FILE, tolerance=DEFAULT_TOLERANCE):
+    """Return a list of regression messages (empty if none), or None if there is no baseline."""
+    if not os.path.exists(path):
+        print(f"No baseline at {path}; run with --save-baseline first")
+        return None
+
+    with open(path, "r") as f:
+        baseline = json.load(f)
+
+    regressions = []
+    for r in results:
+        base = baseline.get(_key(r))
+        if not base:
+            continue
+        if base["best_s"] and r["best_s"] > base["best_s"] * (1 + tolerance):
+            regressions.append(
+                f"{_key(r)} time {base['best_s']:.4f}s -> {r['best_s']:.4f}s"
+            )
+        if base["p95_ms"] and r["p95_ms"] and r["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            regressions.append(
+                f"{_key(r)} p95 {base['p95_ms']:.3f}ms -> {r['p95_ms']:.3f}ms"
+            )
+        if base["peak_mb"] and r["peak_mb"] > base["peak_mb"] * (1 + tolerance):
+            regressions.append(
+                f"{_key(r)} peak {base['peak_mb']:.2f}MB -> {r['peak_mb']:.2f}MB"
+            )
+    return regressions
+
+
+def _ms(value):
+    return f"{value:>10.3f}" if value is not None else f"{'-':>10}"
+
+
+def print_results(results):
+    header = f"{'stage':<18}{'size':>12}{'rows':>10}{'rows/s':>14}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'peak MB':>10}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        size = str(r["size"])
+        if len(size) > 12:
+            size = size[:9] + "..."
+        print(
+            f"{r['stage']:<18}{size:>12}{r['rows']:>10}{r['rows_per_s']:>14,.0f}"
+            f"{_ms(r['p50_ms'])}{_ms(r['p95_ms'])}{_ms(r['p99_ms'])}{r['peak_mb']:>10.2f}"
+        )
+
+
+def _parse_sizes(value):
+    return [int(s) for s in value.split(",") if s.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark M-Ledger ingest and query paths")
+    parser.add_argument("--sizes", type=_parse_sizes, default=DEFAULT_SIZES,
+                        help="comma-separated synthetic row counts (default 1000,10000,100000)")
+    parser.add_argument("--pdf-sizes", type=_parse_sizes, default=DEFAULT_PDF_SIZES,
+                        help="comma-separated row counts for synthetic PDFs (default 1000)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--no-samples", action="store_true",
+                        help="skip the PDFs in mpesa_statements/")
+    parser.add_argument("--no-mongo", action="store_true",
+                        help="skip the mongo_write and query stages")
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--compare", action="store_true")
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--json", help="also write results to this file")
+    args = parser.parse_args(argv)
+
+    col = None
+    if not args.no_mongo:
+        try:
+            col = use_mongomock()
+        except ImportError:
+            print("mongomock is required for the Mongo stages: pip install -r requirements-dev.txt "
+                  "(or pass --no-mongo)")
+            return 2
+    results = []
+
+    for size in args.sizes:
+        print(f"Benchmarking {size:,} rows...")
+        parse_result, txs = bench_parse(size, args.repeat)
+        results.append(parse_result)
+        results.append(bench_categorise(size, args.repeat))
+        results.append(bench_totals(size, txs, args.repeat))
+        if col is not None:
+            totals = app.calculate_totals(txs)
+            results.append(bench_mongo_write(size, txs, totals, col, args.repeat))
+            results.append(bench_query(size, len(txs), args.repeat))
+
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in args.pdf_sizes:
+            print(f"Benchmarking synthetic PDF with {size:,} rows...")
+            try:
+                results.append(bench_extract_pdf(size, args.repeat, workdir))
+            except Exception as e:
+                print(f"  Skipping synthetic PDF extract: {e}")
+
+    if not args.no_samples:
+        print("Benchmarking sample statements...")
+        results.extend(bench_extract_samples(1))
+
+    print()
+    print_results(results)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.save_baseline:
+        save_baseline(results, args.baseline)
+
+    if args.compare:
+        regressions = compare_baseline(results, args.baseline, args.tolerance)
+        if regressions is None:
+            return 2
+        if regressions:
+            print("\nRegressions detected:")
+            for msg in regressions:
+                print(f"  {msg}")
+            return 1
+        print("\nNo regressions against baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,132 @@
+"""
+Shared MongoDB access for M-Ledger.
+
+The client is created on first use and shared by app.py and ai_rag.py, so
+importing either module never opens a connection. It is also fork-safe:
+a process forked by gunicorn or the ingest pool builds its own client
+instead of reusing the parent's sockets.
+"""
+import os
+import threading
+
+MONGODB_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017/")
+DATABASE_NAME = os.getenv("DATABASE_NAME", "Mledger")
+
+# Connection pool tuning, per process
+POOL_OPTIONS = {
+    "maxPoolSize": int(os.getenv("MONGO_MAX_POOL_SIZE", "50")),
+    "minPoolSize": int(os.getenv("MONGO_MIN_POOL_SIZE", "2")),
+    "maxIdleTimeMS": int(os.getenv("MONGO_MAX_IDLE_MS", "60000")),
+    "waitQueueTimeoutMS": int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "5000")),
+    "serverSelectionTimeoutMS": int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000")),
+    "connectTimeoutMS": int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000")),
+}
+
+_client = None
+_client_pid = None
+_async_client = None
+_async_client_pid = None
+_indexes_ready = False
+_lock = threading.Lock()
+
+
+def get_client():
+    """Return this process's shared MongoClient, creating it on first call."""
+    global _client, _client_pid
+    if _client is None or _client_pid != os.getpid():
+        with _lock:
+            if _client is None or _client_pid != os.getpid():
+                from pymongo import MongoClient
+                _client = MongoClient(MONGODB_URI, **POOL_OPTIONS)
+                _client_pid = os.getpid()
+    return _client
+
+
+def get_async_client():
+    """
+    Return this process's shared Motor client for the async endpoints.
+    Must be first called from inside the running event loop.
+    """
+    global _async_client, _async_client_pid
+    if _async_client is None or _async_client_pid != os.getpid():
+        with _lock:
+            if _async_client is None or _async_client_pid != os.getpid():
+                from motor.motor_asyncio import AsyncIOMotorClient
+                _async_client = AsyncIOMotorClient(MONGODB_URI, **POOL_OPTIONS)
+                _async_client_pid = os.getpid()
+    return _async_client
+
+
+def async_statements_collection():
+    return get_async_client()[DATABASE_NAME]["statements"]
+
+
+def use_client(client):
+    """Replace the shared client, e.g. with a mongomock client for benchmarks."""
+    global _client, _client_pid
+    with _lock:
+        _client = client
+        _client_pid = os.getpid()
+
+
+def _reset_after_fork():
+    # The parent's client and lock must not be used from the child
+    global _client, _client_pid, _async_client, _async_client_pid, _lock
+    _client = None
+    _client_pid = None
+    _async_client = None
+    _async_client_pid = None
+    _lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_db():
+    return get_client()[DATABASE_NAME]
+
+
+def statements_collection():
+    return get_db()["statements"]
+
+
+def ensure_indexes():
+    """
+    Create the statements indexes once per process: a unique filename, which
+    upload and auto-ingest upsert on, and account for bulk queries.
+    """
+    global _indexes_ready
+    if _indexes_ready:
+        return
+    with _lock:
+        if _indexes_ready:
+            return
+        collection = statements_collection()
+        try:
+            collection.create_index("filename", unique=True)
+        except Exception as e:
+            # Older databases can hold duplicates; upserts still stop new ones
+            print(f"Warning: could not create unique filename index: {e}")
+        collection.create_index("account")
+        _indexes_ready = True
+
+
+def store_statement(statement, replace=False):
+    """
+    Store a statement keyed by filename and return True if it was written.
+    replace=True overwrites an earlier copy (an explicit re-upload); otherwise
+    an existing statement is kept and nothing is written.
+    """
+    ensure_indexes()
+    collection = statements_collection()
+    key = {"filename": statement["filename"]}
+    if replace:
+        result = collection.replace_one(key, statement, upsert=True)
+    else:
+        result = collection.update_one(key, {"$setOnInsert": statement}, upsert=True)
+        if result.upserted_id is None:
+            return False
+    if result.upserted_id is not None:
+        statement["_id"] = result.upserted_id
+    return True
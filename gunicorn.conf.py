@@ -0,0 +1,77 @@
+"""
+Gunicorn settings for serving M-Ledger in production.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+    WORKER_CLASS=uvicorn.workers.UvicornWorker gunicorn -c gunicorn.conf.py asgi:app
+
+The ASGI mode serves chat, filter and statement data on the event loop (see
+asgi.py); WEB_THREADS only applies to the default gthread workers.
+
+Every worker builds its own Mongo client after fork (see db.py) and sends
+CPU-bound extraction to its own small process pool, so request threads stay
+free while statements are being ingested. Initial ingest of mpesa_statements/
+runs once, in a separate process started by the master.
+
+Each worker and the ingest process write their metrics to METRICS_DIR, and
+/metrics on any worker reports the sum over all of them (see metrics.py).
+Workers recycled by max_requests are folded into one file as they exit.
+"""
+import glob
+import multiprocessing
+import os
+import tempfile
+
+# Set before workers start so every worker and the ingest process inherit it
+os.environ.setdefault("METRICS_DIR", os.path.join(tempfile.gettempdir(), "mledger-metrics"))
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+worker_class = os.getenv("WORKER_CLASS", "gthread")
+threads = int(os.getenv("WEB_THREADS", "4"))
+
+# Uploads wait on extraction, which can take minutes for OCR statements
+timeout = int(os.getenv("WEB_TIMEOUT", "300"))
+graceful_timeout = 30
+keepalive = 5
+
+# Recycle workers periodically to bound memory growth from OCR images
+max_requests = 1000
+max_requests_jitter = 100
+
+# Do not import the app in the master: clients must be created per worker
+preload_app = False
+
+accesslog = "-"
+errorlog = "-"
+
+
+def on_starting(server):
+    # Drop metrics left behind by a previous server run
+    metrics_dir = os.environ["METRICS_DIR"]
+    os.makedirs(metrics_dir, exist_ok=True)
+    for path in glob.glob(os.path.join(metrics_dir, "*.json")):
+        os.remove(path)
+
+
+def child_exit(server, worker):
+    # Keep the exited worker's totals without keeping one file per worker
+    import metrics
+    metrics.merge_exited(worker.pid)
+
+
+def post_worker_init(worker):
+    # Build the search index in the background as soon as the worker is up
+    import search_index
+    search_index.start_background()
+
+
+def when_ready(server):
+    if os.getenv("MLEDGER_INGEST_ON_START", "1") != "1":
+        return
+    # ingest_worker imports app only inside the spawned process
+    import ingest_worker
+
+    ctx = multiprocessing.get_context("spawn")
+    proc = ctx.Process(target=ingest_worker.run, name="mledger-ingest", daemon=True)
+    proc.start()
+    server.log.info("Started initial ingest in process %s", proc.pid)
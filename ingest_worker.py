@@ -0,0 +1,11 @@
+"""
+Target for the initial-ingest process started by gunicorn.conf.py.
+
+Kept separate from app.py so the gunicorn master can reference it without
+importing the application.
+"""
+
+
+def run():
+    import app
+    app.run_ingest_process()
@@ -0,0 +1,365 @@
+"""
+Lightweight per-stage timing for M-Ledger.
+
+Records latency histograms per stage and renders them in the Prometheus text
+exposition format for the /metrics endpoint. Per-file detail goes only to the
+ingest log, one JSON line per statement with its stage timings, so the
+number of series does not grow with every uploaded filename.
+
+Usage:
+    with metrics.file_context("statement.pdf"):
+        with metrics.timed("parse"):
+            ...
+
+Multi-process servers: when METRICS_DIR is set (gunicorn.conf.py does this),
+every process periodically writes its histograms and counters to
+METRICS_DIR/<pid>-<token>.json and /metrics renders the sum over all files,
+so a scrape sees every worker plus the ingest process, not just the worker
+that answered it. When gunicorn reaps a worker its file is folded into
+METRICS_DIR/exited.json, so recycled workers' totals are kept in one file.
+"""
+import atexit
+import glob
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+
+# Every stage name observe() accepts
+STAGES = (
+    "password_trial",
+    "text_extract",
+    "page_render",
+    "ocr_page",
+    "reocr_page",
+    "parse",
+    "categorise",
+    "reconcile",
+    "mongo_write",
+    "query",
+    "search",
+    "llm_call",
+    "pdf_build",
+)
+
+# Seconds. Covers sub-millisecond categorise calls up to multi-minute OCR runs.
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+INGEST_LOG = os.getenv("INGEST_LOG", "ingest_log.jsonl")
+METRICS_DIR = os.getenv("METRICS_DIR")
+FLUSH_INTERVAL = 1.0
+EXITED_FILE = "exited.json"
+
+_current_file = ContextVar("mledger_current_file", default="")
+_capture = ContextVar("mledger_capture", default=None)
+_lock = threading.Lock()
+_histograms = {}
+_file_timings = {}
+_counters = {}
+_dirty = False
+_flusher_pid = None
+_file_token_pid = None
+_file_token = None
+
+
+class Histogram:
+    """Cumulative-bucket histogram matching Prometheus semantics."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+def observe(stage, seconds, file=None):
+    """
+    Record one duration for a stage. It also counts towards the per-file
+    timings of `file`, which defaults to the current file context.
+    """
+    if stage not in STAGES:
+        raise ValueError(f"Unknown metrics stage: {stage!r}")
+    captured = _capture.get()
+    if captured is not None:
+        captured.append((stage, seconds))
+        return
+    if file is None:
+        file = _current_file.get()
+    _mark_dirty()
+    with _lock:
+        hist = _histograms.get(stage)
+        if hist is None:
+            hist = _histograms[stage] = Histogram()
+        hist.observe(seconds)
+        if file:
+            per_file = _file_timings.setdefault(file, {})
+            per_file[stage] = per_file.get(stage, 0.0) + seconds
+
+
+def inc(name, amount=1, **labels):
+    """Increment a counter, e.g. inc("ingest_total", status="ok")."""
+    key = (name, tuple(sorted(labels.items())))
+    _mark_dirty()
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+@contextmanager
+def capture():
+    """
+    Collect (stage, seconds) observations made in this block instead of
+    recording them, e.g. inside a pool process. Pass the list to replay().
+    """
+    observations = []
+    token = _capture.set(observations)
+    try:
+        yield observations
+    finally:
+        _capture.reset(token)
+
+
+def replay(observations, file=None):
+    """Record observations collected by capture(), one sample each."""
+    for stage, seconds in observations:
+        observe(stage, seconds, file)
+
+
+# -- multi-process export ----------------------------------------------------
+
+def _mark_dirty():
+    global _dirty, _flusher_pid
+    if not METRICS_DIR:
+        return
+    _dirty = True
+    if _flusher_pid != os.getpid():
+        _flusher_pid = os.getpid()
+        threading.Thread(target=_flush_loop, name="mledger-metrics-flush", daemon=True).start()
+
+
+def _flush_loop():
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        if _dirty:
+            flush()
+
+
+def _file_name():
+    # pid plus a per-process token: a reused pid never overwrites (and so
+    # never rolls back) the totals of the process that had it before
+    global _file_token_pid, _file_token
+    if _file_token_pid != os.getpid():
+        _file_token_pid = os.getpid()
+        _file_token = uuid.uuid4().hex[:8]
+    return f"{os.getpid()}-{_file_token}.json"
+
+
+def _serialize(histograms, counters):
+    return {
+        "histograms": [[stage, h.counts, h.sum, h.count] for stage, h in histograms.items()],
+        "counters": [[name, list(labels), value] for (name, labels), value in counters.items()],
+    }
+
+
+def _write(path, snapshot):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(snapshot, f)
+    os.replace(tmp, path)
+
+
+def _read(path):
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _merge(histograms, counters, snapshot):
+    for stage, counts, total, count in snapshot.get("histograms", ()):
+        hist = histograms.setdefault(stage, Histogram())
+        hist.counts = [a + b for a, b in zip(hist.counts, counts)]
+        hist.sum += total
+        hist.count += count
+    for name, labels, value in snapshot.get("counters", ()):
+        key = (name, tuple(tuple(pair) for pair in labels))
+        counters[key] = counters.get(key, 0) + value
+
+
+def flush():
+    """Write this process's metrics to METRICS_DIR/<pid>-<token>.json."""
+    global _dirty
+    if not METRICS_DIR:
+        return
+    with _lock:
+        _dirty = False
+        snapshot = _serialize(_histograms, _counters)
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    _write(os.path.join(METRICS_DIR, _file_name()), snapshot)
+
+
+def _flush_at_exit():
+    if _dirty:
+        flush()
+
+
+atexit.register(_flush_at_exit)
+
+
+def merge_exited(pid):
+    """
+    Fold the metrics of exited process `pid` into METRICS_DIR/exited.json and
+    delete its file, so recycled workers don't pile up files. Call from one
+    process only (the gunicorn master's child_exit hook).
+    """
+    if not METRICS_DIR:
+        return
+    paths = glob.glob(os.path.join(METRICS_DIR, f"{pid}-*.json"))
+    if not paths:
+        return
+    aggregate_path = os.path.join(METRICS_DIR, EXITED_FILE)
+    aggregate = _read(aggregate_path) or {}
+    histograms, counters = {}, {}
+    _merge(histograms, counters, aggregate)
+    for path in paths:
+        _merge(histograms, counters, _read(path) or {})
+    # Readers skip the files named in "merged" until they are gone
+    _write(aggregate_path, dict(
+        _serialize(histograms, counters),
+        generation=aggregate.get("generation", 0) + 1,
+        merged=[os.path.basename(path) for path in paths],
+    ))
+    for path in paths:
+        os.remove(path)
+
+
+def _collect():
+    """Return (histograms, counters) merged across all processes."""
+    if not METRICS_DIR:
+        with _lock:
+            return dict(_histograms), dict(_counters)
+
+    flush()
+    aggregate_path = os.path.join(METRICS_DIR, EXITED_FILE)
+    for _ in range(5):
+        aggregate = _read(aggregate_path) or {}
+        histograms, counters = {}, {}
+        _merge(histograms, counters, aggregate)
+        skip = set(aggregate.get("merged", ())) | {EXITED_FILE}
+        for path in glob.glob(os.path.join(METRICS_DIR, "*.json")):
+            if os.path.basename(path) not in skip:
+                _merge(histograms, counters, _read(path) or {})
+        # A worker merged while reading could be missed or counted twice
+        if (_read(aggregate_path) or {}).get("generation") == aggregate.get("generation"):
+            break
+    return histograms, counters
+
+
+@contextmanager
+def timed(stage, file=None):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - start, file)
+
+
+@contextmanager
+def file_context(filename):
+    """Attribute every stage timed inside this block to `filename`."""
+    token = _current_file.set(filename)
+    with _lock:
+        _file_timings[filename] = {}
+    try:
+        yield
+    finally:
+        _current_file.reset(token)
+
+
+def file_timings(filename):
+    """Total seconds spent per stage for the latest run of `filename`."""
+    with _lock:
+        return {k: round(v, 6) for k, v in _file_timings.get(filename, {}).items()}
+
+
+def discard_file(filename):
+    """Forget the per-file timings of `filename` once they have been reported."""
+    with _lock:
+        _file_timings.pop(filename, None)
+
+
+def log_ingest(filename, status, **fields):
+    """
+    Append one JSON line describing an ingest run to INGEST_LOG.
+    The file's timings are dropped afterwards so long-running workers don't grow.
+    """
+    entry = {
+        "timestamp": datetime.utcnow().isoformat(),
+        "filename": filename,
+        "status": status,
+        "stages": file_timings(filename),
+    }
+    discard_file(filename)
+    entry.update(fields)
+    flush()
+    try:
+        with open(INGEST_LOG, "a") as f:
+            f.write(json.dumps(entry, default=str) + "\n")
+    except OSError as e:
+        print(f"Warning: could not write ingest log: {e}")
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(pairs):
+    return ",".join(f'{k}="{_escape(v)}"' for k, v in pairs)
+
+
+def render_prometheus():
+    """Render all histograms and counters in Prometheus text format."""
+    lines = [
+        "# HELP mledger_stage_seconds Time spent per processing stage.",
+        "# TYPE mledger_stage_seconds histogram",
+    ]
+    histograms, counters = _collect()
+    hist_items = sorted(histograms.items())
+    counter_items = sorted(counters.items())
+    for stage, hist in hist_items:
+        base = [("stage", stage)]
+        for bound, count in zip(hist.buckets, hist.counts):
+            lines.append(f"mledger_stage_seconds_bucket{{{_labels(base + [('le', bound)])}}} {count}")
+        lines.append(f"mledger_stage_seconds_bucket{{{_labels(base + [('le', '+Inf')])}}} {hist.count}")
+        lines.append(f"mledger_stage_seconds_sum{{{_labels(base)}}} {hist.sum}")
+        lines.append(f"mledger_stage_seconds_count{{{_labels(base)}}} {hist.count}")
+
+    seen = set()
+    for (name, labels), value in counter_items:
+        metric = f"mledger_{name}"
+        if metric not in seen:
+            lines.append(f"# TYPE {metric} counter")
+            seen.add(metric)
+        label_str = f"{{{_labels(labels)}}}" if labels else ""
+        lines.append(f"{metric}{label_str} {value}")
+
+    return "\n".join(lines) + "\n"
+
+
+def reset():
+    """Clear all recorded metrics."""
+    with _lock:
+        _histograms.clear()
+        _file_timings.clear()
+        _counters.clear()
@@ -0,0 +1,187 @@
+"""
+Balance-continuity check for parsed statements.
+
+Every M-Pesa row carries the running balance after the transaction, so
+    balance[row] == balance[previous row] + signed amount[row]
+must hold down the whole statement. A row where it does not is either a
+misread amount or a misread balance, which is far cheaper to detect here
+than by running high-DPI OCR on every page up front.
+
+Rows completed in the same second (a transfer, its charge and the Fuliza
+overdraft that funded it) are printed in no particular order, so they are
+checked as one group: the group's amounts must take the previous group's
+balance to one of the group's own balances.
+
+Statements are printed newest first, but both orders are checked and the one
+with fewer breaks is used, so synthetic or re-sorted input works too.
+"""
+
+# Amounts are in cents precision; allow for float rounding
+TOLERANCE = 0.01
+
+
+def _signed_amounts(transactions):
+    signed = []
+    for t in transactions:
+        value = t.get("signed_amount")
+        if value is None:
+            amount = t.get("amount") or 0
+            value = amount if t.get("category") == "income" else -amount
+        signed.append(value)
+    return signed
+
+
+def _group_starts(transactions):
+    """Start index of each run of consecutive rows sharing a completion time."""
+    starts = [0]
+    for i in range(1, len(transactions)):
+        when = transactions[i].get("datetime")
+        if when is None or when != transactions[i - 1].get("datetime"):
+            starts.append(i)
+    return starts
+
+
+def _group_bounds(transactions):
+    starts = _group_starts(transactions) if transactions else []
+    return starts, starts[1:] + [len(transactions)]
+
+
+def _broken_groups(balance, signed, starts, sizes):
+    """
+    Groups given oldest first. A group is broken when no balance of the group
+    before it plus the group's amounts gives one of its own balances.
+    """
+    import numpy as np
+
+    sums = np.add.reduceat(signed, starts)
+    # Every (row of previous group, row of this group) pair, flattened
+    prev_sizes, cur_sizes = sizes[:-1], sizes[1:]
+    counts = prev_sizes * cur_sizes
+    group = np.repeat(np.arange(1, len(starts)), counts)
+    k = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    width = cur_sizes[group - 1]
+    prev_row = starts[group - 1] + k // width
+    row = starts[group] + k % width
+
+    ok = np.abs(balance[prev_row] + sums[group] - balance[row]) <= TOLERANCE
+    matched = np.bincount(group[ok], minlength=len(starts)) > 0
+    matched[0] = True
+    return ~matched
+
+
+def _breaks(balance, signed, transactions):
+    import numpy as np
+
+    starts = np.array(_group_starts(transactions))
+    sizes = np.diff(np.append(starts, len(transactions)))
+    broken = _broken_groups(balance, signed, starts, sizes)
+    return np.flatnonzero(np.repeat(broken, sizes))
+
+
+def _check(transactions):
+    """Return (newest_first, indices of broken rows) for the better-fitting order."""
+    import numpy as np
+
+    if len(transactions) < 2:
+        return True, []
+
+    balance = np.array([t.get("balance") or 0 for t in transactions], dtype=float)
+    signed = np.array(_signed_amounts(transactions), dtype=float)
+
+    # Oldest first: each group follows the group above it
+    forward = _breaks(balance, signed, transactions)
+    # Newest first: each group follows the group below it
+    backward = _breaks(balance[::-1], signed[::-1], transactions[::-1])
+
+    if len(forward) < len(backward):
+        return False, forward.tolist()
+    return True, sorted((len(transactions) - 1 - backward).tolist())
+
+
+def find_balance_breaks(transactions):
+    """
+    Return the indices of rows whose balance does not follow from their
+    neighbour's balance and their own amount.
+    """
+    return _check(transactions)[1]
+
+
+def _chain(rows, balance, signed, opening):
+    """Order rows so each balance follows from the one before, as far as possible."""
+    ordered, remaining, current = [], list(rows), opening
+    while remaining:
+        nxt = next((r for r in remaining if abs(current + signed[r] - balance[r]) <= TOLERANCE), None)
+        if nxt is None:
+            break
+        ordered.append(nxt)
+        remaining.remove(nxt)
+        current = balance[nxt]
+    return ordered, remaining
+
+
+def _order_group(rows, balance, signed, opening):
+    if len(rows) == 1:
+        return rows
+    if opening is None:
+        # First group: try each row as the one that opened it
+        chains = [_chain(rows, balance, signed, balance[r] - signed[r]) for r in rows]
+        ordered, remaining = min(chains, key=lambda c: len(c[1]))
+        opening = balance[ordered[0]] - signed[ordered[0]] if ordered else None
+    else:
+        ordered, remaining = _chain(rows, balance, signed, opening)
+    if remaining and opening is not None:
+        # No full chain: the row holding the group's closing balance goes last
+        closing = opening + sum(signed[r] for r in rows)
+        order = ordered + remaining
+        last = next((r for r in reversed(order) if abs(balance[r] - closing) <= TOLERANCE), None)
+        if last is not None:
+            order.remove(last)
+            order.append(last)
+        return order
+    return ordered + remaining
+
+
+def chronological_order(transactions):
+    """
+    Return row indices oldest first. Rows sharing a completion time are put
+    in the order their balances follow from each other, not print order.
+    """
+    newest_first, _ = _check(transactions)
+    balance = [t.get("balance") or 0 for t in transactions]
+    signed = _signed_amounts(transactions)
+    rows = list(range(len(transactions)))
+    if newest_first:
+        rows.reverse()
+
+    order = []
+    opening = None
+    for start, end in zip(*_group_bounds([transactions[i] for i in rows])):
+        group = _order_group(rows[start:end], balance, signed, opening)
+        order.extend(group)
+        opening = balance[group[-1]]
+    return order
+
+
+def number_rows(transactions):
+    """Set seq on every row: its position in the statement, oldest first."""
+    for seq, i in enumerate(chronological_order(transactions)):
+        transactions[i]["seq"] = seq
+
+
+def flag_balance_breaks(transactions):
+    """Set balance_ok on every row and return the indices of broken rows."""
+    breaks = find_balance_breaks(transactions)
+    broken = set(breaks)
+    for i, t in enumerate(transactions):
+        t["balance_ok"] = i not in broken
+    return breaks
+
+
+def pages_to_recheck(transactions, breaks):
+    """Pages holding a broken row or the neighbour it was checked against."""
+    pages = set()
+    for i in breaks:
+        for j in (i - 1, i, i + 1):
+            if 0 <= j < len(transactions) and transactions[j].get("page") is not None:
+                pages.add(transactions[j]["page"])
+    return sorted(pages)
@@ -0,0 +1,283 @@
+"""
+In-memory search index over stored transactions.
+
+Indexes each transaction's description, party, type and reference so /search
+can answer token, prefix and fuzzy lookups without scanning statements.
+Fuzzy matching is aimed at OCR damage:
+  - digit-like tokens are folded (O->0, I/l->1, S->5, B->8, ...) so a garbled
+    phone number or till still matches
+  - Kenyan phone numbers are indexed by their last 9 digits, so 07..., 2547...
+    and +2547... forms all match each other
+  - remaining misses fall back to a trigram candidate lookup with a bounded
+    edit distance, which catches misspelled names
+
+The index is built from Mongo by a background thread, started per worker
+from gunicorn.conf.py (or on the first search), extended incrementally as
+statements are ingested, and picks up statements written by other processes
+every REFRESH_INTERVAL seconds. Searches never touch Mongo. Rows repeated
+across overlapping statement files are indexed once.
+"""
+import bisect
+import heapq
+import os
+import re
+import threading
+import time
+from datetime import timedelta
+
+import db
+
+REFRESH_INTERVAL = float(os.getenv("SEARCH_REFRESH_INTERVAL", "5"))
+REFRESH_OVERLAP = timedelta(seconds=float(os.getenv("SEARCH_REFRESH_OVERLAP", "300")))
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_OCR_DIGIT_FOLD = str.maketrans({"o": "0", "q": "0", "d": "0", "i": "1", "l": "1",
+                                 "z": "2", "s": "5", "g": "6", "t": "7", "b": "8"})
+
+EXACT_SCORE = 3
+PREFIX_SCORE = 2
+FUZZY_SCORE = 1
+
+
+def _fold(token):
+    """Fold OCR letter/digit confusions in tokens that are mostly digits."""
+    digits = sum(c.isdigit() for c in token)
+    if digits and digits * 2 >= len(token):
+        return token.translate(_OCR_DIGIT_FOLD)
+    return token
+
+
+def tokenize(text, query=False):
+    """
+    Lowercase, split and OCR-fold text. Long numbers are also indexed by their
+    last 9 digits; in a query only that form is used, so any phone prefix matches.
+    """
+    tokens = []
+    for raw in _TOKEN_RE.findall((text or "").lower()):
+        token = _fold(raw)
+        if token.isdigit() and len(token) >= 9:
+            if not query:
+                tokens.append(token)
+            tokens.append(token[-9:])
+        else:
+            tokens.append(token)
+    return tokens
+
+
+def _trigrams(token):
+    padded = f"  {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _edit_distance(a, b, limit):
+    """
+    Edit distance counting adjacent transpositions as one edit.
+    Returns limit + 1 as soon as the limit is exceeded.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    before = None
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, start=1):
+        cur = [i] + [0] * len(b)
+        for j, cb in enumerate(b, start=1):
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb))
+            if before is not None and j > 1 and ca == b[j - 2] and a[i - 2] == cb:
+                cur[j] = min(cur[j], before[j - 2] + 1)
+        if min(cur) > limit:
+            return limit + 1
+        before, prev = prev, cur
+    return prev[-1]
+
+
+def _max_distance(token):
+    if len(token) <= 3:
+        return 0
+    if len(token) <= 6:
+        return 1
+    return 2
+
+
+class TransactionSearchIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._docs = []              # doc id -> transaction summary
+        self._postings = {}          # token -> set of doc ids
+        self._sorted_tokens = []     # for prefix lookups
+        self._trigram_tokens = {}    # trigram -> set of tokens
+        self._statements = set()     # indexed statement ids
+        self._rows = set()           # (reference, datetime, type, amount) already indexed
+        self._built = False
+        self._last_uploaded_at = None
+        self._refresher_pid = None
+
+    # -- building ------------------------------------------------------------
+
+    def _add_token(self, token, doc_id):
+        postings = self._postings.get(token)
+        if postings is None:
+            postings = self._postings[token] = set()
+            bisect.insort(self._sorted_tokens, token)
+            for gram in _trigrams(token):
+                self._trigram_tokens.setdefault(gram, set()).add(token)
+        postings.add(doc_id)
+
+    def add_statement(self, statement):
+        """Index every transaction of a stored statement document. Idempotent."""
+        statement_id = str(statement.get("_id") or statement.get("filename"))
+        with self._lock:
+            if statement_id in self._statements:
+                return
+            self._statements.add(statement_id)
+
+            for t in statement.get("transactions", []):
+                # Same transaction from an overlapping statement file
+                row_key = (t.get("reference"), t.get("datetime"), t.get("transaction_type"), t.get("amount"))
+                if row_key in self._rows:
+                    continue
+                self._rows.add(row_key)
+
+                doc_id = len(self._docs)
+                self._docs.append({
+                    "filename": statement.get("filename"),
+                    "date": t.get("date"),
+                    "time": t.get("time"),
+                    "reference": t.get("reference"),
+                    "description": t.get("description"),
+                    "type": t.get("transaction_type"),
+                    "party": t.get("party"),
+                    "category": t.get("category"),
+                    "amount": t.get("amount"),
+                    "balance": t.get("balance"),
+                })
+                text = " ".join(str(t.get(k) or "") for k in
+                                ("description", "party", "transaction_type", "reference"))
+                for token in tokenize(text):
+                    self._add_token(token, doc_id)
+
+    def refresh(self):
+        """
+        Index statements stored since the last refresh (all of them the first
+        time). Mongo is read outside the index lock; only each add takes it.
+
+        The watermark only moves on what this read saw, never on local adds,
+        and each read reaches REFRESH_OVERLAP back past it: other processes
+        stamp uploaded_at before their insert lands, so statements can
+        become visible out of order. Re-read statements are skipped by id.
+        """
+        since = self._last_uploaded_at if self._built else None
+        query = {"uploaded_at": {"$gte": since - REFRESH_OVERLAP}} if since else {}
+        projection = {"filename": 1, "uploaded_at": 1, "transactions": 1}
+        newest = since
+        for statement in db.statements_collection().find(query, projection):
+            self.add_statement(statement)
+            uploaded_at = statement.get("uploaded_at")
+            if uploaded_at and (newest is None or uploaded_at > newest):
+                newest = uploaded_at
+        self._last_uploaded_at = newest
+        self._built = True
+
+    def start_background(self, interval=REFRESH_INTERVAL):
+        """Build, then keep refreshing, from a daemon thread. Once per process."""
+        with self._lock:
+            if self._refresher_pid == os.getpid():
+                return
+            self._refresher_pid = os.getpid()
+        threading.Thread(target=self._refresh_loop, args=(interval,),
+                         name="mledger-search-refresh", daemon=True).start()
+
+    def _refresh_loop(self, interval):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Search index refresh failed: {e}")
+            time.sleep(interval)
+
+    # -- querying ------------------------------------------------------------
+
+    def _match_term(self, term):
+        """Return {doc_id: score} for one query token."""
+        scores = {}
+
+        def add(doc_ids, score):
+            for doc_id in doc_ids:
+                if scores.get(doc_id, 0) < score:
+                    scores[doc_id] = score
+
+        exact = self._postings.get(term)
+        if exact:
+            add(exact, EXACT_SCORE)
+
+        tokens = self._sorted_tokens
+        i = bisect.bisect_left(tokens, term)
+        while i < len(tokens) and tokens[i].startswith(term):
+            if tokens[i] != term:
+                add(self._postings[tokens[i]], PREFIX_SCORE)
+            i += 1
+
+        limit = _max_distance(term)
+        if not scores and limit:
+            grams = _trigrams(term)
+            counts = {}
+            for gram in grams:
+                for token in self._trigram_tokens.get(gram, ()):
+                    counts[token] = counts.get(token, 0) + 1
+            # A token within `limit` edits shares at least this many trigrams;
+            # one edit changes up to 4 (an adjacent transposition does)
+            needed = max(1, len(grams) - 4 * limit)
+            for token, shared in counts.items():
+                if shared >= needed and _edit_distance(term, token, limit) <= limit:
+                    add(self._postings[token], FUZZY_SCORE)
+
+        return scores
+
+    def search(self, query, limit=50, direction="all"):
+        """
+        Return transactions matching every term of `query`, best matches first.
+        direction: 'sent' (expenses), 'received' (income) or 'all'.
+        """
+        terms = tokenize(query, query=True)
+        if not terms:
+            return []
+
+        with self._lock:
+            combined = None
+            for term in dict.fromkeys(terms):
+                scores = self._match_term(term)
+                if combined is None:
+                    combined = scores
+                else:
+                    combined = {d: s + scores[d] for d, s in combined.items() if d in scores}
+                if not combined:
+                    return []
+
+            results = []
+            for doc_id, score in combined.items():
+                doc = self._docs[doc_id]
+                if direction == "sent" and doc["category"] != "expense":
+                    continue
+                if direction == "received" and doc["category"] != "income":
+                    continue
+                results.append((score, doc))
+
+        top = heapq.nlargest(limit, results,
+                             key=lambda r: (r[0], r[1]["date"] or "", r[1]["time"] or ""))
+        return [dict(doc, score=score) for score, doc in top]
+
+
+index = TransactionSearchIndex()
+
+
+def add_statement(statement):
+    index.add_statement(statement)
+
+
+def start_background():
+    index.start_background()
+
+
+def search(query, limit=50, direction="all"):
+    # No-op once the refresher is running; covers servers without the gunicorn hook
+    index.start_background()
+    return index.search(query, limit=limit, direction=direction)
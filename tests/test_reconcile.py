@@ -0,0 +1,108 @@
+from datetime import datetime
+
+import pytest
+
+import reconcile
+
+
+def row(reference, when, amount, balance, page=None):
+    t = {
+        "reference": reference,
+        "datetime": datetime.strptime(when, "%Y-%m-%d %H:%M:%S"),
+        "signed_amount": amount,
+        "amount": abs(amount),
+        "balance": balance,
+    }
+    if page is not None:
+        t["page"] = page
+    return t
+
+
+# Rows 15-29 of the 2026-02 statement in data_cache.json, as printed (newest
+# first). Both Fuliza groups come out of order within their second.
+FULIZA_ROWS = [
+    row("UAURA59KEA", "2026-01-30 18:30:11", -23.00, 1250.00),
+    row("UAURA59KEA", "2026-01-30 18:30:11", -1250.00, 0.00),
+    row("UAURA59KEA", "2026-01-30 18:30:11", 962.08, 1273.00),
+    row("UAURA59HM4", "2026-01-30 18:29:30", 300.00, 310.92),
+    row("UAURA59FYA", "2026-01-30 18:21:53", -100.00, 10.92),
+    row("UAURA58YCL", "2026-01-30 16:49:15", -40.00, 110.92),
+    row("UAURA5968K", "2026-01-30 16:46:45", -140.00, 150.92),
+    row("UAURA58ZTD", "2026-01-30 16:46:10", -909.08, 290.92),
+    row("UAURA593AE", "2026-01-30 16:46:10", 1200.00, 1200.00),
+    row("UAURA58VDL", "2026-01-30 16:41:16", -100.00, 0.00),
+    row("UAU4D5H9SM", "2026-01-30 16:41:15", 100.00, 100.00),
+    row("UAURA5878X", "2026-01-30 12:20:14", -1000.00, 13.00),
+    row("UAURA5878X", "2026-01-30 12:20:14", -13.00, 0.00),
+    row("UAURA5878X", "2026-01-30 12:20:14", 999.08, 1013.00),
+    row("UAURA5804N", "2026-01-30 11:22:58", -2500.00, 13.92),
+]
+
+# Transfer and its charge, both printed with the group's closing balance
+SAME_BALANCE_ROWS = [
+    row("UB1RA5ESIO", "2026-02-01 09:47:49", -7.00, 693.66),
+    row("UB1RA5ESIO", "2026-02-01 09:47:49", -390.00, 693.66),
+    row("UB1705EJO4", "2026-02-01 09:44:50", 1048.00, 1090.66),
+]
+
+
+def test_scrambled_same_second_groups_pass():
+    assert reconcile.find_balance_breaks(FULIZA_ROWS) == []
+
+
+def test_group_printed_with_one_balance_passes():
+    assert reconcile.find_balance_breaks(SAME_BALANCE_ROWS) == []
+
+
+def test_oldest_first_order_passes():
+    assert reconcile.find_balance_breaks(FULIZA_ROWS[::-1]) == []
+
+
+def test_misread_amount_flags_its_group_only():
+    rows = [dict(t) for t in FULIZA_ROWS]
+    rows[12]["signed_amount"] = -18.00  # UAURA5878X charge, OCR 13 -> 18
+    assert reconcile.find_balance_breaks(rows) == [11, 12, 13]
+
+
+def test_misread_balance_flags_row_and_its_successor():
+    rows = [dict(t) for t in FULIZA_ROWS]
+    rows[4]["balance"] = 16.92  # UAURA59FYA, OCR 10.92 -> 16.92
+    assert reconcile.find_balance_breaks(rows) == [3, 4]
+
+
+def test_flag_balance_breaks_marks_rows():
+    rows = [dict(t) for t in FULIZA_ROWS]
+    rows[12]["signed_amount"] = -18.00
+    reconcile.flag_balance_breaks(rows)
+    assert [i for i, t in enumerate(rows) if not t["balance_ok"]] == [11, 12, 13]
+
+
+@pytest.mark.parametrize("rows", [[], FULIZA_ROWS[:1]])
+def test_short_statements_have_no_breaks(rows):
+    assert reconcile.find_balance_breaks(rows) == []
+
+
+def test_pages_to_recheck_includes_neighbours():
+    rows = [row("R%d" % i, "2026-01-30 10:00:%02d" % (59 - i), -1.0, 100.0 - i, page=i // 2 + 1)
+            for i in range(6)]
+    assert reconcile.pages_to_recheck(rows, [2]) == [1, 2]
+
+
+@pytest.mark.parametrize("rows", [FULIZA_ROWS, FULIZA_ROWS[::-1]])
+def test_chronological_order_follows_balances(rows):
+    ordered = [rows[i] for i in reconcile.chronological_order(rows)]
+    assert [t["balance"] for t in ordered[:4]] == [13.92, 1013.00, 13.00, 0.00]
+    assert [t["balance"] for t in ordered[-3:]] == [1273.00, 1250.00, 0.00]
+
+
+def test_chronological_order_puts_closing_balance_last():
+    ordered = reconcile.chronological_order(SAME_BALANCE_ROWS)
+    assert ordered[0] == 2
+    assert sorted(ordered[1:]) == [0, 1]
+
+
+def test_number_rows_sets_seq():
+    rows = [dict(t) for t in FULIZA_ROWS]
+    reconcile.number_rows(rows)
+    assert sorted(t["seq"] for t in rows) == list(range(len(rows)))
+    assert rows[12]["seq"] == 3  # UAURA5878X charge closes its group
@@ -0,0 +1,87 @@
+from datetime import datetime
+
+import mongomock
+import pytest
+
+import db
+import search_index
+
+
+def statement(_id, uploaded_at, party, reference):
+    return {
+        "_id": _id,
+        "filename": f"MPESA_Statement_{_id}.pdf",
+        "uploaded_at": uploaded_at,
+        "transactions": [{
+            "reference": reference,
+            "datetime": uploaded_at,
+            "date": uploaded_at.strftime("%Y-%m-%d"),
+            "time": uploaded_at.strftime("%H:%M:%S"),
+            "description": f"Customer Transfer to - 0712345678 {party}",
+            "transaction_type": "Send Money",
+            "party": party,
+            "category": "expense",
+            "amount": 100.0,
+            "balance": 900.0,
+        }],
+    }
+
+
+@pytest.fixture
+def collection():
+    client = mongomock.MongoClient()
+    db.use_client(client)
+    return db.statements_collection()
+
+
+@pytest.fixture
+def index():
+    index = search_index.TransactionSearchIndex()
+    for i, party in enumerate(["JOHN KAMAU", "PETER MWANGI", "MARY OTIENO"]):
+        index.add_statement(statement(i, datetime(2026, 1, 30, 10, i), party, f"UAURA58{i}AB"))
+    return index
+
+
+@pytest.mark.parametrize("query, party", [
+    ("jhon", "JOHN KAMAU"),
+    ("mwnagi", "PETER MWANGI"),
+    ("otineo", "MARY OTIENO"),
+    ("mwamgi", "PETER MWANGI"),
+])
+def test_one_edit_names_match(index, query, party):
+    assert [r["party"] for r in index.search(query)] == [party]
+
+
+def test_phone_prefixes_match(index):
+    assert len(index.search("254712345678")) == 3
+
+
+def test_overlapping_statements_index_rows_once(index):
+    index.add_statement(dict(statement(9, datetime(2026, 1, 30, 10, 0), "JOHN KAMAU", "UAURA580AB"), _id=10))
+    assert len(index.search("john")) == 1
+
+
+def test_refresh_picks_up_other_processes_after_local_add(collection):
+    index = search_index.TransactionSearchIndex()
+    index.refresh()
+
+    # The ingest process stores one statement, then this worker takes an upload
+    collection.insert_one(statement(1, datetime(2026, 2, 1, 0, 0, 10), "MARY OTIENO", "UB1RA5ESIO"))
+    upload = statement(2, datetime(2026, 2, 1, 0, 0, 11), "JOHN KAMAU", "UB1705EJO4")
+    collection.insert_one(upload)
+    index.add_statement(upload)
+
+    index.refresh()
+    assert [r["party"] for r in index.search("otieno")] == ["MARY OTIENO"]
+    assert len(index.search("kamau")) == 1
+
+
+def test_refresh_rereads_overlap_window_for_late_inserts(collection):
+    index = search_index.TransactionSearchIndex()
+    collection.insert_one(statement(1, datetime(2026, 2, 1, 0, 0, 11), "JOHN KAMAU", "UB1705EJO4"))
+    index.refresh()
+
+    # Stamped earlier, but its insert landed after the last refresh
+    collection.insert_one(statement(2, datetime(2026, 2, 1, 0, 0, 10), "MARY OTIENO", "UB1RA5ESIO"))
+    index.refresh()
+    assert [r["party"] for r in index.search("otieno")] == ["MARY OTIENO"]